@@ -142,6 +142,15 @@ class ONNXModel:
                                       Callable[[compiled_sdfg.CompiledSDFG],
                                                None]] = {}
 
+        #: hooks that are executed before each call of the compiled sdfg
+        self.pre_call_hooks: Dict[str, Callable[[compiled_sdfg.CompiledSDFG],
+                                                None]] = {}
+
+        #: the compiled sdfg, reused across calls until :attr:`sdfg` is replaced or transformed. Set this to
+        #: ``None`` after modifying :attr:`sdfg` without transformations so that it is recompiled on the next call.
+        self.compiled_sdfg: Optional[compiled_sdfg.CompiledSDFG] = None
+        self._compiled_transformation_count = 0
+
         for value, is_input in chain(zip(graph.input, repeat(True)),
                                      zip(graph.output, repeat(False))):
             if not value.HasField("name"):
@@ -378,10 +387,21 @@ class ONNXModel:
         inputs, params, symbols, outputs = self._call_args(args=args,
                                                            kwargs=kwargs)
 
-        if self.do_auto_optimize:
-            self.auto_optimize()
-
-        compiled = self.compile_and_init()
+        # applying a transformation appends it to the transformation history of the sdfg
+        if (self.compiled_sdfg is None
+                or self.compiled_sdfg.sdfg is not self.sdfg
+                or self._compiled_transformation_count != len(
+                    self.sdfg.transformation_hist)):
+            if self.do_auto_optimize:
+                self.auto_optimize()
+
+            self.compiled_sdfg = self.compile_and_init()
+            self._compiled_transformation_count = len(
+                self.sdfg.transformation_hist)
+
+        compiled = self.compiled_sdfg
+        for _, hook in self.pre_call_hooks.items():
+            hook(compiled)
 
         compiled(**inputs, **outputs, **params, **symbols)
 
@@ -616,3 +616,19 @@ class PureReshape(ONNXForward):
             reshaped[:] = np.reshape(data, new_shape)
 
         return program_for_node(prog, sdfg, state, node)
+
+
+@autoregister_params(op="Flatten", name="pure")
+class PureFlatten(ONNXForward):
+    @staticmethod
+    def forward(node: onnx_op.ONNXOp, state: SDFGState,
+                sdfg: SDFG) -> typing.Union[Node, SDFG]:
+        node.validate(sdfg, state)
+
+        # flatten is a reshape to the (already inferred) output shape
+        new_shape = out_desc_with_name(node, state, sdfg, "output").shape
+
+        def prog(input, output):
+            output[:] = np.reshape(input, new_shape)
+
+        return program_for_node(prog, sdfg, state, node)
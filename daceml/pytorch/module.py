@@ -1,21 +1,79 @@
 import collections
+import hashlib
+import io
+import json
 import logging
 import os
 import tempfile
 from functools import wraps
-from typing import Optional, Tuple, Callable, OrderedDict
+from typing import Optional, Tuple, Callable, OrderedDict, Dict
 
 import dace
 import onnx
+import pkg_resources
 import torch
 import torch.nn as nn
+from dace.transformation.auto_optimize import find_fast_library
 from torch.onnx import TrainingMode
 
+import daceml.onnx as donnx
 from daceml.autodiff.pytorch import make_backward_function
 from daceml.onnx import ONNXModel
+from daceml.onnx.nodes.onnx_op import _ONNX_OPS_BY_NAME
 from daceml.onnx.shape_inference import infer_shapes
 from daceml.util import utils
 
+log = logging.getLogger(__name__)
+
+
+def _implementation_settings() -> tuple:
+    """ Collect the default implementation of the onnx library and of each onnx op. These decide how the
+        ONNX nodes are expanded, so they are part of the cache keys.
+    """
+    return (donnx.default_implementation,
+            tuple(
+                sorted((name, op.default_implementation)
+                       for name, op in _ONNX_OPS_BY_NAME.items())))
+
+
+def _environment_settings(cuda: bool) -> tuple:
+    """ Collect the versions, the dace configuration and the available libraries. These decide how the
+        SDFG is exported, optimized and deserialized, so they are part of the on-disk cache key.
+    """
+    try:
+        daceml_version = pkg_resources.get_distribution("daceml").version
+    except pkg_resources.DistributionNotFound:
+        daceml_version = None
+
+    return (dace.__version__, daceml_version, torch.__version__,
+            onnx.__version__,
+            json.dumps(dace.Config._config, sort_keys=True, default=str),
+            tuple(
+                sorted((k, v) for k, v in os.environ.items()
+                       if k.startswith("DACE_"))),
+            tuple(
+                find_fast_library(
+                    dace.DeviceType.GPU if cuda else dace.DeviceType.CPU)))
+
+
+def _atomic_save(save: Callable[[str], None], path: str):
+    """ Save a file through a temporary file in the same directory, so that other processes sharing the
+        cache never read a partially written file.
+
+        :param save: a function that writes the file to the path it is given.
+        :param path: the final path of the file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp")
+    os.close(fd)
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
 
 class DaceModule(nn.Module):
     """ A wrapper that converts a PyTorch ``nn.Module`` to a PyTorch compatible data-centric ``nn.Module``.
@@ -29,6 +87,15 @@ class DaceModule(nn.Module):
                              but can be slow).
         :param sdfg_name: the name to give to the sdfg (defaults to ``dace_model``).
         :param auto_optimize: whether to apply automatic optimizations.
+        :param cache_dir: if not ``None``, cache the exported ONNX model and the converted SDFG in this directory.
+                          Changes to the state dict, the input shapes, the conversion flags or the installed
+                          versions invalidate the cache; changes to the code of ``forward`` are not detected.
+        :param cache_key: a string identifying the post-onnx hooks registered in addition to the builtin ones.
+                          Without it, only the ONNX export is cached in ``cache_dir`` when such hooks are registered.
+
+        Converted SDFGs are also cached in memory for the lifetime of the process (see ``sdfg_cache_size``). Custom
+        post-onnx hooks are matched by identity; conversions whose hooks register post-compile or pre-call hooks
+        are not cached.
 
         :Example:
 
@@ -47,6 +114,13 @@ class DaceModule(nn.Module):
             Automatically expanded library node "ONNX_Sqrt_1" with implementation "onnxruntime".
             tensor([0., 0.])
     """
+    #: maximum number of converted SDFGs kept in the in-memory cache
+    sdfg_cache_size = 8
+
+    #: in-memory cache mapping conversion keys to serialized SDFGs, the weights added by the post-onnx hooks and
+    #: the custom post-onnx hooks, in LRU order
+    _sdfg_cache: OrderedDict[tuple, tuple] = collections.OrderedDict()
+
     def __init__(self,
                  module: nn.Module,
                  dummy_inputs: Optional[Tuple[torch.Tensor]] = None,
@@ -55,7 +129,9 @@ class DaceModule(nn.Module):
                  backward=False,
                  apply_strict: bool = True,
                  auto_optimize: bool = True,
-                 sdfg_name: Optional[str] = None):
+                 sdfg_name: Optional[str] = None,
+                 cache_dir: Optional[str] = None,
+                 cache_key: Optional[str] = None):
         super(DaceModule, self).__init__()
 
         self.backward = backward
@@ -64,7 +140,10 @@ class DaceModule(nn.Module):
         self.train = train
         self.sdfg: Optional[dace.SDFG] = None
         self.cuda = cuda
+        self.apply_strict = apply_strict
         self.sdfg_name = sdfg_name or "dace_model"
+        self.cache_dir = cache_dir
+        self.cache_key = cache_key
 
         self.function = None
 
@@ -107,11 +186,20 @@ class DaceModule(nn.Module):
                 self.post_onnx_hooks["apply_strict"] = \
                     lambda onnx_model: onnx_model.sdfg.apply_strict_transformations()
 
+        self._builtin_post_onnx_hooks = dict(self.post_onnx_hooks)
+
         if dummy_inputs is not None:
             self.function = self._initialize_sdfg(dummy_inputs)
 
     def reset_sdfg(self):
-        """ Clear the sdfg so that optimizations are reapplied. """
+        """ Clear the sdfg so that optimizations are reapplied.
+
+            The sdfg is compiled on the first call and reused until it is transformed. After modifying
+            ``self.sdfg`` without transformations, set ``self.dace_model.compiled_sdfg`` to ``None`` so that it
+            is recompiled on the next call.
+        """
+        if self.dace_model is not None:
+            self.dace_model.compiled_sdfg = None
         self.function = None
 
     def prepend_post_onnx_hook(self, name: str, func: Callable[[ONNXModel],
@@ -134,57 +222,198 @@ class DaceModule(nn.Module):
                                                  None]):
         self.post_autodiff_hooks[name] = func
 
-    def _initialize_sdfg(self, dummy_inputs):
-        # TODO change to StringIO if not too big
-        with tempfile.TemporaryDirectory() as dir_name:
-            export_name = os.path.join(dir_name, "export.onnx")
-
-            torch.onnx.export(
-                self.model,
-                dummy_inputs,
-                export_name,
-                verbose=logging.root.level <= logging.DEBUG,
-                training=(TrainingMode.TRAINING
-                          if self.train else TrainingMode.EVAL),
-                opset_version=12,
-                strip_doc_string=False,
-                export_params=not self.backward,
-                # pytorch constant folding will add new unnamed inputs to the graph and remove some of the
-                # named parameters of the model: this means that we can't match with the state dict
-                # anymore, so we disable this. Our CF is more flexible.
-                do_constant_folding=False)
-
-            onnx_model = infer_shapes(onnx.load(export_name))
-            self.onnx_model = onnx_model
-
-            dace_model = ONNXModel(self.sdfg_name,
-                                   onnx_model,
-                                   infer_shapes=False,
-                                   cuda=self.cuda,
-                                   parent_pytorch_module=self.model)
-            self.sdfg = dace_model.sdfg
-            self.dace_model = dace_model
-
-            self.sdfg.validate()
+    def _cache_key(self, dummy_inputs) -> str:
+        """ Compute the key under which the conversion of ``self.model`` with ``dummy_inputs`` is cached.
+
+            :param dummy_inputs: the inputs used for tracing.
+            :return: a hex digest identifying the conversion.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(
+            repr((type(self.model).__module__, type(self.model).__qualname__,
+                  self.sdfg_name, self.cuda, self.train, self.backward,
+                  self.apply_strict, tuple(self.post_onnx_hooks),
+                  tuple(self._custom_post_onnx_hooks()), self.cache_key,
+                  _implementation_settings(), _environment_settings(self.cuda),
+                  tuple((tuple(inp.shape), str(inp.dtype))
+                        for inp in dummy_inputs))).encode())
+        for name, tensor in self.model.state_dict().items():
+            tensor = tensor.detach().cpu()
+            hasher.update((name + str(tensor.dtype)).encode())
+            if tensor.dtype is torch.bfloat16:
+                # numpy has no bfloat16; converting to float32 is exact
+                tensor = tensor.float()
+            hasher.update(tensor.numpy().tobytes())
+        return hasher.hexdigest()
+
+    def _custom_post_onnx_hooks(
+            self) -> Dict[str, Callable[[ONNXModel], None]]:
+        """ Return the post-onnx hooks that were registered in addition to the builtin optimization hooks. """
+        return {
+            name: hook
+            for name, hook in self.post_onnx_hooks.items()
+            if self._builtin_post_onnx_hooks.get(name) is not hook
+        }
+
+    def _memory_cache_key(self, onnx_model: onnx.ModelProto) -> tuple:
+        """ Compute the key under which the SDFG converted from ``onnx_model`` is cached in memory.
+
+            :param onnx_model: the exported onnx model.
+            :return: a hashable key identifying the conversion.
+        """
+        # the builtin hooks are determined by the conversion flags, custom hooks are identified by the hook objects.
+        # The cache entries keep the custom hooks alive, so their ids are not reused while they are cached.
+        custom_hooks = self._custom_post_onnx_hooks()
+        hooks = tuple((name, id(hook) if name in custom_hooks else None)
+                      for name, hook in self.post_onnx_hooks.items())
+        return (type(self.model),
+                hashlib.sha1(onnx_model.SerializeToString()).hexdigest(),
+                self.cuda, self.backward, self.apply_strict, hooks,
+                _implementation_settings())
+
+    def _use_cached_sdfg(self, dace_model: ONNXModel, sdfg: dace.SDFG,
+                         weights: Dict[str, torch.Tensor]):
+        """ Replace the sdfg of ``dace_model`` with a cached sdfg.
+
+            :param dace_model: the freshly imported model.
+            :param sdfg: the cached sdfg.
+            :param weights: the weights that were added by the post-onnx hooks when the sdfg was converted.
+        """
+        sdfg.name = self.sdfg_name
+        sdfg._parent_onnx_model = dace_model
+        dace_model.sdfg = sdfg
+        dace_model.state = sdfg.nodes()[0]
+        dace_model.weights.update(weights)
 
+    def _initialize_sdfg(self, dummy_inputs):
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_path = os.path.join(self.cache_dir,
+                                      self._cache_key(dummy_inputs))
+
+        if cache_path is not None and os.path.isfile(
+                os.path.join(cache_path, "export.onnx")):
+            onnx_model = onnx.load(os.path.join(cache_path, "export.onnx"))
+        else:
+            # pytorch constant folding will add new unnamed inputs to the graph and remove some of the
+            # named parameters of the model: this means that we can't match with the state dict
+            # anymore. It is only enabled for inference-only modules without parameters; otherwise our CF
+            # is more flexible.
+            do_constant_folding = (not self.backward and not self.train and
+                                   next(self.model.parameters(), None) is None)
+
+            export_buffer = io.BytesIO()
+            torch.onnx.export(self.model,
+                              dummy_inputs,
+                              export_buffer,
+                              verbose=logging.root.level <= logging.DEBUG,
+                              training=(TrainingMode.TRAINING
+                                        if self.train else TrainingMode.EVAL),
+                              opset_version=12,
+                              strip_doc_string=True,
+                              export_params=not self.backward,
+                              keep_initializers_as_inputs=False,
+                              do_constant_folding=do_constant_folding)
+
+            export_buffer.seek(0)
+            onnx_model = infer_shapes(onnx.load(export_buffer))
+
+            if cache_path is not None:
+                os.makedirs(cache_path, exist_ok=True)
+                _atomic_save(lambda path: onnx.save(onnx_model, path),
+                             os.path.join(cache_path, "export.onnx"))
+
+        self.onnx_model = onnx_model
+
+        dace_model = ONNXModel(self.sdfg_name,
+                               onnx_model,
+                               infer_shapes=False,
+                               cuda=self.cuda,
+                               parent_pytorch_module=self.model)
+
+        memory_key = self._memory_cache_key(onnx_model)
+        custom_hooks = self._custom_post_onnx_hooks()
+        cached_sdfg = cached_weights = None
+        # the sdfg depends on the custom hooks, which are only identified by the user-supplied cache key
+        if cache_path is not None and (self.cache_key is not None
+                                       or not custom_hooks):
+            cached_sdfg = os.path.join(cache_path, self.sdfg_name + ".sdfg")
+            cached_weights = os.path.join(cache_path,
+                                          self.sdfg_name + ".weights.pt")
+
+        # the weights and hooks that the post-onnx hooks add are part of the conversion
+        imported_weights = set(dace_model.weights)
+        imported_post_compile_hooks = set(dace_model.post_compile_hooks)
+        imported_pre_call_hooks = set(dace_model.pre_call_hooks)
+
+        if memory_key in DaceModule._sdfg_cache:
+            DaceModule._sdfg_cache.move_to_end(memory_key)
+            sdfg_json, weights, _ = DaceModule._sdfg_cache[memory_key]
+            self._use_cached_sdfg(dace_model, dace.serialize.loads(sdfg_json),
+                                  weights)
+            sdfg_cache_hit = True
+        elif cached_sdfg is not None and os.path.isfile(
+                cached_sdfg) and os.path.isfile(cached_weights):
+            self._use_cached_sdfg(dace_model, dace.SDFG.from_file(cached_sdfg),
+                                  torch.load(cached_weights))
+            sdfg_cache_hit = True
+        else:
+            sdfg_cache_hit = False
+
+        self.sdfg = dace_model.sdfg
+        self.dace_model = dace_model
+
+        self.sdfg.validate()
+
+        if not sdfg_cache_hit:
             for _, hook in self.post_onnx_hooks.items():
                 hook(self.dace_model)
 
-            if self.backward:
-                function = make_backward_function(dace_model)
+        added_weights = {
+            name: weight
+            for name, weight in dace_model.weights.items()
+            if name not in imported_weights
+        }
+        # compile and call hooks close over the objects of this conversion, so they can't be cached
+        added_hooks = (
+            set(dace_model.post_compile_hooks) != imported_post_compile_hooks
+            or set(dace_model.pre_call_hooks) != imported_pre_call_hooks)
+
+        if not sdfg_cache_hit and cached_sdfg is not None:
+            if added_hooks:
+                log.debug(
+                    "Not caching the sdfg since the post-onnx hooks registered post-compile or pre-call hooks"
+                )
+            else:
+                # save the weights first: the sdfg file marks the entry as complete
+                _atomic_save(lambda path: torch.save(added_weights, path),
+                             cached_weights)
+                _atomic_save(self.sdfg.save, cached_sdfg)
 
-                for _, hook in self.post_autodiff_hooks.items():
-                    hook(function._forward_model.sdfg, function._backward_sdfg)
+        if (memory_key not in DaceModule._sdfg_cache and not added_hooks
+                and DaceModule.sdfg_cache_size > 0):
+            sdfg_json = dace.serialize.dumps(self.sdfg.to_json())
+            DaceModule._sdfg_cache[memory_key] = (sdfg_json, added_weights,
+                                                  tuple(custom_hooks.values()))
+            if len(DaceModule._sdfg_cache) > DaceModule.sdfg_cache_size:
+                DaceModule._sdfg_cache.popitem(last=False)
 
-                def forward(*args):
-                    args_and_params = list(args)
-                    args_and_params.extend(self.parameters())
-                    return function.apply(*args_and_params)
+        if self.backward:
+            function = make_backward_function(dace_model)
 
-                return forward
-            else:
+            for _, hook in self.post_autodiff_hooks.items():
+                hook(function._forward_model.sdfg, function._backward_sdfg)
+
+            # the parameters are inputs to the backward function. In-place updates (optimizer steps,
+            # load_state_dict, .to()) keep the same Parameter objects, so we only need to collect them once.
+            parameters = tuple(self.parameters())
+
+            def forward(*args):
+                return function.apply(*args, *parameters)
 
-                return dace_model
+            return forward
+        else:
+            return dace_model
 
     def forward(self, *actual_inputs):
         """ Execute the forward pass using the traced ``module``."""
@@ -202,7 +431,9 @@ def dace_module(moduleclass,
                 backward=False,
                 apply_strict: bool = True,
                 auto_optimize: bool = True,
-                sdfg_name: Optional[str] = None):
+                sdfg_name: Optional[str] = None,
+                cache_dir: Optional[str] = None,
+                cache_key: Optional[str] = None):
     """ Decorator to apply on a definition of a ``torch.nn.Module`` to
         convert it to a data-centric module upon construction.
 
@@ -230,6 +461,8 @@ def dace_module(moduleclass,
                              but can be slow).
         :param auto_optimize: whether to apply automatic optimizations.
         :param sdfg_name: the name to give to the sdfg (defaults to ``dace_model``).
+        :param cache_dir: if not ``None``, cache the exported ONNX model and the converted SDFG in this directory.
+        :param cache_key: a string identifying the post-onnx hooks registered in addition to the builtin ones.
     """
     @wraps(moduleclass)
     def _create(*args, **kwargs):
@@ -240,6 +473,8 @@ def dace_module(moduleclass,
                           backward=backward,
                           apply_strict=apply_strict,
                           auto_optimize=auto_optimize,
-                          sdfg_name=sdfg_name)
+                          sdfg_name=sdfg_name,
+                          cache_dir=cache_dir,
+                          cache_key=cache_key)
 
     return _create
@@ -64,7 +64,8 @@ def parameter_to_transient(dace_module: DaceModule, parameter_path: str):
         dace_module.dace_model.post_compile_hooks[
             "initialize_hook"] = lambda sdfg: sdfg.initialize()
 
-    def post_compile_hook(compiled_sdfg):
+    # copy before each call so that in-place updates of the parameter are picked up
+    def copy_parameter_hook(compiled_sdfg):
         struct = compiled_sdfg.get_state_struct()
 
         if not hasattr(struct, gpu_array_name):
@@ -78,5 +79,8 @@ def parameter_to_transient(dace_module: DaceModule, parameter_path: str):
             ptr, compiled_sdfg.sdfg.arrays[gpu_array_name])
         torch_tensor[:] = pt_tensor
 
-    dace_module.dace_model.post_compile_hooks[
-        "init_" + pt_weight_name] = post_compile_hook
+    dace_module.dace_model.pre_call_hooks["copy_" +
+                                          pt_weight_name] = copy_parameter_hook
+
+    # the sdfg changed: recompile it on the next call
+    dace_module.dace_model.compiled_sdfg = None
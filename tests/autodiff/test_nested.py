@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 import torch
 
 import dace
@@ -114,12 +115,10 @@ def test_triple_nested_forwarding():
             dict(Y=np.random.rand(3, 3).astype(np.float32)))
 
 
+@pytest.mark.pure
 @run_correctness
 def test_view_forwarding():
     # Prepare the inner sdfg
-    old_default = donnx.default_implementation
-    donnx.default_implementation = "pure"
-
     @dace.program
     def add_reshape_grad_test_nested(inp: dace.float64[9],
                                      bias: dace.float64[3],
@@ -137,8 +136,6 @@ def test_view_forwarding():
     sdfg.expand_library_nodes()
     sdfg.apply_strict_transformations()
 
-    donnx.default_implementation = old_default
-
     # Prepare the outer SDFG
 
     @dace.program
@@ -682,11 +682,9 @@ def test_reshape():
                  bias=np.random.rand(3).astype(np.float64)))
 
 
+@pytest.mark.pure
 @run_correctness
 def test_reshape_on_memlet_path():
-    old_default = donnx.default_implementation
-    donnx.default_implementation = "pure"
-
     @dace.program
     def single_state_reshape_memlet_path(inp: dace.float64[9],
                                          bias: dace.float64[3],
@@ -703,8 +701,6 @@ def test_reshape_on_memlet_path():
     sdfg.expand_library_nodes()
     sdfg.apply_strict_transformations()
 
-    donnx.default_implementation = old_default
-
     def torch_func(*, inp, bias):
         reshaped = torch.reshape(inp, [3, 3])
 
@@ -720,11 +716,9 @@ def test_reshape_on_memlet_path():
                  bias=np.random.rand(3).astype(np.float64)))
 
 
+@pytest.mark.pure
 @run_correctness
 def test_reshape_reuse_in_same_state():
-    old_default = donnx.default_implementation
-    donnx.default_implementation = "pure"
-
     @dace.program
     def single_state_reshape_same_state(inp: dace.float64[9],
                                         target_shape: dace.int64[2]):
@@ -739,8 +733,6 @@ def test_reshape_reuse_in_same_state():
     sdfg.expand_library_nodes()
     sdfg.apply_strict_transformations()
 
-    donnx.default_implementation = old_default
-
     def torch_func(*, inp):
         reshaped = torch.reshape(inp, [3, 3])
 
@@ -305,6 +305,38 @@ def test_reshape(new_shape, sdfg_name):
     assert np.allclose(numpy_result, result)
 
 
+@pytest.mark.pure
+@pytest.mark.parametrize("axis", [0, 1, 2, -1])
+def test_flatten(axis, sdfg_name):
+    X = np.random.normal(scale=10, size=(2, 4, 10)).astype(np.float32)
+
+    numpy_result = X.reshape(int(np.prod(X.shape[:axis])), -1)
+
+    sdfg = dace.SDFG(sdfg_name)
+
+    sdfg.add_array("X", [2, 4, 10], dace.float32)
+    sdfg.add_array("__return", numpy_result.shape, dace.float32)
+
+    state = sdfg.add_state()
+    access_X = state.add_access("X")
+    access_result = state.add_access("__return")
+
+    op_node = donnx.ONNXFlatten("flatten", axis=axis)
+
+    state.add_node(op_node)
+    state.add_edge(access_X, None, op_node, "input",
+                   sdfg.make_array_memlet("X"))
+
+    state.add_edge(op_node, "output", access_result, None,
+                   sdfg.make_array_memlet("__return"))
+
+    sdfg.expand_library_nodes()
+
+    result = sdfg(X=X)
+
+    assert np.allclose(numpy_result, result)
+
+
 @pytest.mark.pure
 @pytest.mark.parametrize("axis", [0, -1])
 def test_softmax(axis, sdfg_name):
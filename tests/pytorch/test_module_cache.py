@@ -0,0 +1,240 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import numpy as np
+import dace
+from dace.transformation.dataflow import RedundantSecondArray
+
+from daceml.onnx import ONNXModel
+from daceml.pytorch import DaceModule
+from daceml.transformation import ConstantFolding
+
+
+class Model(nn.Module):
+    def __init__(self):
+        super(Model, self).__init__()
+        self.fc1 = nn.Linear(4, 8)
+        self.fc2 = nn.Linear(8, 2)
+
+    def forward(self, x):
+        x = F.relu(self.fc1(x))
+        return self.fc2(x)
+
+
+class ReshapeModel(nn.Module):
+    def __init__(self):
+        super(ReshapeModel, self).__init__()
+        self.fc1 = nn.Linear(4, 8)
+
+    def forward(self, x):
+        x = self.fc1(x)
+        return x.view(x.shape[0], 2, 4)
+
+
+def test_compile_once(sdfg_name, monkeypatch):
+    compile_calls = []
+    compile_and_init = ONNXModel.compile_and_init
+
+    def counting_compile_and_init(onnx_model):
+        compile_calls.append(onnx_model)
+        return compile_and_init(onnx_model)
+
+    monkeypatch.setattr(ONNXModel, "compile_and_init",
+                        counting_compile_and_init)
+
+    ptmodel = Model()
+    x = torch.rand(3, 4)
+    torch_output = ptmodel(x)
+
+    dace_model = DaceModule(ptmodel, sdfg_name=sdfg_name)
+    for _ in range(2):
+        dace_output = dace_model(x)
+        assert np.allclose(torch_output.detach().numpy(),
+                           dace_output,
+                           atol=1e-06)
+    assert len(compile_calls) == 1
+
+    # clearing the compiled sdfg recompiles it on the next call
+    dace_model.dace_model.compiled_sdfg = None
+    dace_model(x)
+    assert len(compile_calls) == 2
+
+
+def test_cache_dir(sdfg_name, tmp_path, monkeypatch):
+    # disable the in-memory cache so that the on-disk cache is exercised
+    monkeypatch.setattr(DaceModule, "sdfg_cache_size", 0)
+
+    ptmodel = Model()
+    x = torch.rand(3, 4)
+    torch_output = ptmodel(x)
+
+    hook_calls = []
+
+    def make_dace_model(cache_key="count_calls"):
+        dace_model = DaceModule(ptmodel,
+                                sdfg_name=sdfg_name,
+                                cache_dir=str(tmp_path),
+                                cache_key=cache_key)
+        dace_model.append_post_onnx_hook(
+            "count_calls", lambda onnx_model: hook_calls.append(onnx_model))
+        return dace_model
+
+    dace_output_0 = make_dace_model()(x)
+    assert len(hook_calls) == 1
+
+    # the second conversion should be served from the cache
+    dace_output_1 = make_dace_model()(x)
+    assert len(hook_calls) == 1
+
+    assert np.allclose(torch_output.detach().numpy(),
+                       dace_output_0,
+                       atol=1e-06)
+    assert np.allclose(torch_output.detach().numpy(),
+                       dace_output_1,
+                       atol=1e-06)
+
+    # changing the weights should miss the cache
+    with torch.no_grad():
+        ptmodel.fc1.weight.add_(1)
+    make_dace_model()(x)
+    assert len(hook_calls) == 2
+
+    # without a cache key, the sdfg converted with custom hooks is not cached
+    make_dace_model(cache_key=None)(x)
+    make_dace_model(cache_key=None)(x)
+    assert len(hook_calls) == 4
+
+
+def test_cache_dir_constant_folding(sdfg_name, tmp_path, monkeypatch):
+    monkeypatch.setattr(DaceModule, "sdfg_cache_size", 0)
+
+    ptmodel = ReshapeModel()
+    x = torch.rand(3, 4)
+    torch_output = ptmodel(x)
+
+    hook_calls = []
+
+    def constant_folding(onnx_model):
+        hook_calls.append(onnx_model)
+        onnx_model.sdfg.apply_transformations_repeated(
+            [ConstantFolding, RedundantSecondArray],
+            validate_all=True,
+            strict=True)
+
+    for _ in range(2):
+        dace_model = DaceModule(ptmodel,
+                                sdfg_name=sdfg_name,
+                                cache_dir=str(tmp_path),
+                                cache_key="constant_folding")
+        dace_model.prepend_post_onnx_hook("constant_folding", constant_folding)
+
+        # the weights added by constant folding are restored on a cache hit
+        dace_output = dace_model(x)
+        assert np.allclose(torch_output.detach().numpy(),
+                           dace_output,
+                           atol=1e-06)
+
+    assert len(hook_calls) == 1
+
+
+def test_memory_cache(sdfg_name):
+    ptmodel = Model()
+    x = torch.rand(3, 4)
+    torch_output = ptmodel(x)
+
+    hook_calls = []
+
+    def count_calls(onnx_model):
+        hook_calls.append(onnx_model)
+
+    def make_dace_model(hook):
+        dace_model = DaceModule(ptmodel, sdfg_name=sdfg_name)
+        dace_model.append_post_onnx_hook("count_calls", hook)
+        return dace_model
+
+    outputs = [make_dace_model(count_calls)(x) for _ in range(2)]
+    assert len(hook_calls) == 1
+
+    for dace_output in outputs:
+        assert np.allclose(torch_output.detach().numpy(),
+                           dace_output,
+                           atol=1e-06)
+
+    # hooks are identified by the hook objects, so a new hook misses the cache
+    make_dace_model(lambda onnx_model: count_calls(onnx_model))(x)
+    assert len(hook_calls) == 2
+
+
+def test_memory_cache_constant_folding(sdfg_name):
+    ptmodel = ReshapeModel()
+    x = torch.rand(3, 4)
+    torch_output = ptmodel(x)
+
+    hook_calls = []
+
+    def constant_folding(onnx_model):
+        hook_calls.append(onnx_model)
+        onnx_model.sdfg.apply_transformations_repeated(
+            [ConstantFolding, RedundantSecondArray],
+            validate_all=True,
+            strict=True)
+
+    for _ in range(2):
+        dace_model = DaceModule(ptmodel, sdfg_name=sdfg_name)
+        dace_model.prepend_post_onnx_hook("constant_folding", constant_folding)
+
+        # the weights added by constant folding are restored on a cache hit
+        dace_output = dace_model(x)
+        assert np.allclose(torch_output.detach().numpy(),
+                           dace_output,
+                           atol=1e-06)
+
+    assert len(hook_calls) == 1
+
+
+def test_memory_cache_added_state(sdfg_name):
+    ptmodel = Model()
+    x = torch.rand(3, 4)
+    torch_output = ptmodel(x)
+
+    hook_calls = []
+
+    def add_constant(onnx_model):
+        hook_calls.append(onnx_model)
+        onnx_model.sdfg.add_array("added_constant", [2], dace.float32)
+        onnx_model.weights["added_constant"] = torch.ones(2)
+
+    dace_models = []
+    for _ in range(2):
+        dace_model = DaceModule(ptmodel, sdfg_name=sdfg_name)
+        dace_model.append_post_onnx_hook("add_constant", add_constant)
+        dace_output = dace_model(x)
+        assert np.allclose(torch_output.detach().numpy(),
+                           dace_output,
+                           atol=1e-06)
+        dace_models.append(dace_model)
+
+    # the weights added by the hook are restored on a cache hit
+    assert len(hook_calls) == 1
+    assert torch.equal(dace_models[1].dace_model.weights["added_constant"],
+                       torch.ones(2))
+
+    pre_call_models = []
+
+    def add_pre_call_hook(onnx_model):
+        hook_calls.append(onnx_model)
+        onnx_model.pre_call_hooks["record"] = \
+            lambda compiled_sdfg: pre_call_models.append(onnx_model)
+
+    # conversions that register pre-call hooks are not cached, so each module gets its own hook
+    dace_models = []
+    for _ in range(2):
+        dace_model = DaceModule(ptmodel, sdfg_name=sdfg_name)
+        dace_model.append_post_onnx_hook("add_pre_call_hook",
+                                         add_pre_call_hook)
+        dace_model(x)
+        dace_models.append(dace_model)
+
+    assert len(hook_calls) == 3
+    assert pre_call_models == [m.dace_model for m in dace_models]
@@ -1,5 +1,6 @@
 import pytest
 import torch
+from dace import dtypes
 from torch import nn
 
 from daceml.pytorch import DaceModule
@@ -26,5 +27,20 @@ def test_pytorch_from_dlpack():
     dace_module = DaceModule(dace_module, cuda=True)
 
     assert torch.allclose(dace_module(input), pt_module(input))
+    compiled_before = dace_module.dace_model.compiled_sdfg
+
     parameter_to_transient(dace_module, "fc1.weight")
     assert torch.allclose(dace_module(input), pt_module(input))
+
+    # the sdfg was recompiled with the weight as a persistent transient
+    compiled_after = dace_module.dace_model.compiled_sdfg
+    assert compiled_after is not compiled_before
+    assert any(desc.transient
+               and desc.lifetime is dtypes.AllocationLifetime.Persistent
+               for desc in compiled_after.sdfg.arrays.values())
+
+    # in-place updates of the parameter are copied to the transient
+    with torch.no_grad():
+        pt_module.fc1.weight.add_(1)
+        dace_module.model.fc1.weight.add_(1)
+    assert torch.allclose(dace_module(input), pt_module(input))